@@ -1,6 +1,6 @@
 from .config import Config
-from .runner import run_benchmark, bench_multiple_invocations, bench_single_invocations, async_call, sync_call, format_response_dict
-from .metrics import benchmark_statistics, format_results, write_results_to_file_csv
+from .runner import run_benchmark, run_batch, close_session, bench_multiple_invocations, bench_single_invocations, async_call, sync_call, format_response_dict
+from .metrics import RunningStats, allocate_metrics, benchmark_statistics, format_results, write_results_to_file_csv, write_batch_results_to_file_csv
 
 # Solo exponer las funciones esenciales
-__all__ = ['Config', 'run_benchmark']
\ No newline at end of file
+__all__ = ['Config', 'run_benchmark', 'run_batch', 'close_session']
\ No newline at end of file
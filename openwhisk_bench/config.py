@@ -1,8 +1,70 @@
 import argparse
+import copy
 import logging as log
 import json
 import os
-import yaml
+import orjson
+from yaml import load as yaml_load
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+# Parsed YAML configurations and raw JSON inputs, keyed by path (each entry holds the file's modification time)
+_config_cache = {}
+_payload_cache = {}
+
+
+def read_cached(cache, path, mode, read):
+    """
+    Return read(file) for the file at path, reusing the cached result while the file is not modified
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, mode) as file:
+            cached = cache[path] = (mtime, read(file))
+    return cached[1]
+
+
+def load_yaml_file(path):
+    """
+    Load a YAML file, reusing the parsed result while the file is not modified.
+    Returns a copy, so callers can modify it without affecting later loads.
+    """
+    return copy.deepcopy(read_cached(_config_cache, path, 'r', lambda file: yaml_load(file, Loader=SafeLoader)))
+
+
+def load_json_file(path):
+    """
+    Load a JSON file, reusing the file contents while it is not modified.
+    The contents are parsed on every call (orjson parses faster than a deep copy), so each caller gets its own object.
+    """
+    return orjson.loads(read_cached(_payload_cache, path, 'rb', lambda file: file.read()))
+
+
+def encode_payload(payload):
+    """
+    Encode a payload as JSON bytes, or None (no request body) if there is no payload
+    """
+    if payload is None:
+        return None
+    try:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # orjson rejects some values stdlib json accepts (e.g. integers wider than 64 bits)
+        return json.dumps(payload).encode('utf-8')
+
+
+def positive_int(value):
+    """
+    argparse type for integer arguments that must be at least 1
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 
 class Config:
@@ -11,23 +73,28 @@ class Config:
         default_config_path = os.path.join('openwhisk_bench/configs', 'defaults.yaml')
         self.load_defaults(default_config_path)
 
+        # HTTP session shared by all the invocations (created by the runner)
+        self.session = None
+
 
     def load_defaults(self, config_path):
         """
         Load default configurations from a yaml file
         """
-        
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
+        config = load_yaml_file(config_path)
 
         self.num_runs = config['num_runs']
         self.num_invocations = config['num_invocations']
         self.warmup_invocations = config['warmup_invocations']
         self.workers = config['workers']
+        self.concurrency = config.get('concurrency', 1)
+        if not isinstance(self.concurrency, int) or self.concurrency < 1:
+            raise ValueError(f"concurrency must be an integer of at least 1, got {self.concurrency!r} ({config_path})")
         self.verbose = config['verbose']
         self.print_csv = config['print_csv']
         self.function = config['function']
         self.blocking = config['blocking']
+        self.aio = config.get('aio', False)
         self.input_file = config['input_file']
         self.input_string = config['input_string']
         self.output_file = config['output_file']
@@ -37,6 +104,20 @@ class Config:
         self.authorization = config['authorization']
         self.payload = config['payload']
         self.directory = config['directory']
+        self.batch = config.get('batch')
+
+
+    def build_requests(self):
+        """
+        Precompute the URLs, headers and encoded payload used by every invocation, so they are not rebuilt on each call.
+        Must be called again if the apihost, function, workers, authorization or payload change.
+        """
+        action_url = f"{self.apihost}/namespaces/_/actions/{self.function}"
+        self.sync_url = f"{action_url}?blocking=true&result=true&workers={self.workers}"
+        self.async_url = f"{action_url}?blocking=false&result=true&workers={self.workers}"
+        self.activation_url_prefix = f"{self.apihost}/namespaces/_/activations/"
+        self.headers = {'Authorization': self.authorization, 'Content-Type': 'application/json'}
+        self.payload_bytes = encode_payload(self.payload)
 
 
     def print_config(self):
@@ -50,10 +131,12 @@ class Config:
             "Number of invocations": self.num_invocations,
             "Warmup runs": self.warmup_invocations,
             "Workers": self.workers,
+            "Concurrency": self.concurrency,
             "Verbose": self.verbose,
             "print_csv": self.print_csv,
             "Function": self.function,
             "Blocking": self.blocking,
+            "Aio": self.aio,
             "Input file": self.input_file,
             "Input string": self.input_string,
             "Output file": self.output_file,
@@ -61,7 +144,8 @@ class Config:
             "Time precision (ms)": self.time_precision,
             "APIHOST": self.apihost,
             "Authorization": self.authorization,
-            "Directory": self.directory
+            "Directory": self.directory,
+            "Batch file": self.batch
         }
 
         if self.payload is not None:
@@ -93,18 +177,24 @@ class Config:
 
         parser.add_argument('-W', '--workers', type=int, default=self.workers, metavar='',
                             help=f'Number of workers invoked por activation (for burst OpenWhisk) (default: {self.workers})')
+
+        parser.add_argument('-C', '--concurrency', type=positive_int, default=self.concurrency, metavar='',
+                            help=f'Number of invocations issued concurrently by the client (default: {self.concurrency})')
         
         parser.add_argument('-f', '--function', type=str, default=self.function, metavar='',
                             help=f'Name of the function to benchmark (default: {self.function})')
         
         parser.add_argument('-b', '--blocking', action='store_true', default=self.blocking,
                     help='Enable blocking call (default: {})'.format(self.blocking))
+
+        parser.add_argument('-x', '--aio', action='store_true', default=self.aio,
+                            help='Drive the concurrent invocations from an asyncio event loop with aiohttp (default: {})'.format(self.aio))
         
         parser.add_argument('-t', '--time-limit', type=int, default=self.time_limit, metavar='',
                             help=f'Time limit for each benchmark (default: {self.time_limit} seconds)')
 
         parser.add_argument('-T', '--time-precision', type=int, default=self.time_precision, metavar='',
-                            help=f'Time precision for measuring elapsed time (default: {self.time_precision} ms)')
+                            help=f'Time precision for measuring elapsed time, used as the initial poll interval of non-blocking calls (default: {self.time_precision} ms)')
         
         parser.add_argument('-v', '--verbose', action='store_true', default=self.verbose,
                             help='Enable verbose output (default: {})'.format(self.verbose))
@@ -122,7 +212,11 @@ class Config:
 
         input_group.add_argument('-d', '--directory', type=str, default=self.directory, metavar='',
                                  help='Input directory containing the input jsons (default: {})\n the whole benchmark will be runned for each of the jsons'.format(self.directory))
+
+        input_group.add_argument('-B', '--batch', type=str, default=self.batch, metavar='',
+                                 help='JSONL file with one benchmark job per line (function, payload, num_invocations), all run in the same process (default: {})'.format(self.batch))
                                 
+
         parser.add_argument('-o', '--output_file', type=str, default=self.output_file, metavar='',
                             help='Output file for the function (default: {})'.format(self.output_file))
 
@@ -140,7 +234,10 @@ class Config:
 
         if args.yaml:
             print(f"Loading configurations from {args.yaml}")
-            self.load_defaults(args.yaml)
+            try:
+                self.load_defaults(args.yaml)
+            except ValueError as e:
+                parser.error(str(e))
         else:
             print("Loading configurations from command line arguments")
             # Updating configuration with parsed arguments
@@ -148,12 +245,15 @@ class Config:
             self.num_invocations = args.num_invocations
             self.warmup_invocations = args.warmup_invocations
             self.workers = args.workers
+            self.concurrency = args.concurrency
             self.function = args.function
             self.blocking = args.blocking
+            self.aio = args.aio
             self.input_file = args.input_file
             self.input_string = args.input_string
             self.directory = args.directory
             self.output_file = args.output_file
+            self.batch = args.batch
             self.time_limit = args.time_limit
             self.time_precision = args.time_precision
             self.apihost = args.apihost
@@ -162,7 +262,7 @@ class Config:
             self.verbose = args.verbose
 
             if self.input_file:
-                self.payload = json.loads(open(self.input_file).read())
+                self.payload = load_json_file(self.input_file)
             elif self.input_string:
                 self.payload = json.loads(self.input_string)
 
@@ -1,95 +1,141 @@
-import statistics
+import numpy as np
 import json
+import orjson
 import csv
 import logging as log
 from tabulate import tabulate
 
 
+# Timing metrics, in the column order used by the metrics arrays
+METRIC_NAMES = ('initTime', 'waitTime', 'duration', 'client_elapsed_time')
+METRIC_LABELS = ('InitTime', 'WaitTime', 'Duration', 'Client Elapsed Time')
+
+RESULTS_HEADERS = ("Metric", "Average", "Minimum", "Maximum", "Standard Deviation")
+CSV_FIELDNAMES = ['Metric', 'Average', 'Min', 'Max', 'Std', 'Success Rate']
+
+
+def allocate_metrics(num_invocations):
+    """
+    Allocates the arrays holding the metrics of num_invocations invocations:
+    one row of timings (in METRIC_NAMES order) and one success flag per invocation.
+    """
+    return np.empty((num_invocations, len(METRIC_NAMES)), dtype=np.float64), np.empty(num_invocations, dtype=bool)
+
+
 def extract_metrics(response, config):
     """
     Extracts relevant metrics from the get_response JSON content, including initTime, duration, client_elapsed_time, waitTime, and success.
+    Returns them as a (initTime, waitTime, duration, client_elapsed_time, success) tuple.
     """
     try:
-        json_response = response.json()
-        annotations = {item['key']: item['value'] for item in json_response.get('annotations', [])}
-        
-        init_time = annotations.get('initTime', 0)
-        wait_time = annotations.get('waitTime', 0)
+        json_response = orjson.loads(response.content)
+
+        # Only initTime and waitTime are needed from the annotations
+        init_time = wait_time = 0
+        found = 0
+        for item in json_response.get('annotations', []):
+            if item['key'] == 'initTime':
+                init_time = item['value']
+                found += 1
+            elif item['key'] == 'waitTime':
+                wait_time = item['value']
+                found += 1
+            if found == 2: break
+
         duration = json_response.get('duration', 0)
-        client_elapsed_time = getattr(response, 'client_elapsed_time', 0)
+        client_elapsed_time = response.client_elapsed_time
         if config.blocking: success = json_response.get('success', False)
-        else: success = json_response.get('response', {}).get('status', '').lower() == 'success'
-
-        return {
-            'initTime': init_time,
-            'waitTime': wait_time,
-            'duration': duration,
-            'client_elapsed_time': client_elapsed_time,
-            'success': success
+        else: success = json_response.get('response', {}).get('status') == 'success'  # OpenWhisk statuses are always lowercase
+
+        return init_time, wait_time, duration, client_elapsed_time, success
+    except (ValueError, KeyError): return 0, 0, 0, 0, False
+
+
+class RunningStats:
+    """
+    Accumulates the statistics of the metrics batch by batch, so only the current batch has to be kept in memory.
+    Batches are merged with the parallel variant of Welford's algorithm (Chan et al.).
+    """
+    def __init__(self):
+        self.count = 0
+        self.successes = 0
+        self.mean = np.zeros(len(METRIC_NAMES))
+        self.m2 = np.zeros(len(METRIC_NAMES))  # Sum of squared differences from the mean
+        self.min = np.full(len(METRIC_NAMES), np.inf)
+        self.max = np.full(len(METRIC_NAMES), -np.inf)
+
+    def update(self, metrics, success):
+        """
+        Merges a batch of metrics arrays (see allocate_metrics) into the running statistics.
+        """
+        batch_count = len(metrics)
+        if batch_count == 0:
+            return
+
+        # Reduce every metric (column) of the batch at once
+        batch_mean = metrics.mean(axis=0)
+        batch_m2 = ((metrics - batch_mean) ** 2).sum(axis=0)
+
+        count = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * batch_count / count
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * batch_count / count
+        self.count = count
+        self.successes += int(success.sum())
+        np.minimum(self.min, metrics.min(axis=0), out=self.min)
+        np.maximum(self.max, metrics.max(axis=0), out=self.max)
+
+    def statistics(self):
+        """
+        Returns average, minimum, maximum and standard deviation for each metric, and the overall success rate.
+        """
+        stds = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.zeros(len(METRIC_NAMES))
+
+        stats = {
+            name: {'avg': float(self.mean[i]), 'min': float(self.min[i]), 'max': float(self.max[i]), 'std': float(stds[i])}
+            for i, name in enumerate(METRIC_NAMES)
         }
-    except (ValueError, KeyError): return {'initTime': 0, 'waitTime': 0, 'duration': 0, 'client_elapsed_time': 0, 'success': False}
+        stats['success_rate'] = self.successes / self.count * 100
+        return stats
 
 
-def benchmark_statistics(metrics_list):
+def benchmark_statistics(metrics, success):
     """
-    Computes statistics for each metric.
-    Returns average, minimum, and maximum for initTime, duration, and client_elapsed_time,
-    and the overall success rate.
+    One-shot wrapper over RunningStats, for metrics arrays that are already complete (see allocate_metrics).
+    Returns the same dict as RunningStats.statistics(): average, minimum, maximum and standard deviation
+    for each metric in METRIC_NAMES, and the overall success rate.
     """
-    init_times = [m['initTime'] for m in metrics_list]
-    wait_times = [m['waitTime'] for m in metrics_list]
-    durations = [m['duration'] for m in metrics_list]
-    client_elapsed_times = [m['client_elapsed_time'] for m in metrics_list]
-    success_rate = sum(1 for m in metrics_list if m['success']) / len(metrics_list) * 100
+    running_stats = RunningStats()
+    running_stats.update(metrics, success)
+    return running_stats.statistics()
 
-    def calculate_stats(data):
-        """Calculates avg, min, max, and std for a given list of data."""
-        return {
-            'avg': statistics.mean(data),
-            'min': min(data),
-            'max': max(data),
-            'std': statistics.stdev(data) if len(data) > 1 else 0
-        }
 
-    stats = {
-        'initTime': calculate_stats(init_times),
-        'waitTime': calculate_stats(wait_times),
-        'duration': calculate_stats(durations),
-        'client_elapsed_time': calculate_stats(client_elapsed_times),
-        'success_rate': success_rate
-    }
-    return stats
+def format_metric_rows(stats):
+    """
+    Formats the statistics as one row per metric, plus the success rate row.
+    """
+    rows = [
+        [label, f"{stats[name]['avg']:.4f}", f"{stats[name]['min']:.4f}", f"{stats[name]['max']:.4f}", f"{stats[name]['std']:.4f}"]
+        for name, label in zip(METRIC_NAMES, METRIC_LABELS)
+    ]
+    rows.append(["Success Rate", f"{stats['success_rate']:.2f}%", "-", "-", "-"])
+    return rows
 
 
 def format_results(stats, config):
     """
     Formats the benchmark results for display.
     """
+    rows = format_metric_rows(stats)
 
     if config.print_csv:
         # Print the results as a CSV string
-        result = (
-            f"Metric,Average,Minimum,Maximum,Standard Deviation\n"
-            f"InitTime,{stats['initTime']['avg']:.4f},{stats['initTime']['min']:.4f},{stats['initTime']['max']:.4f},{stats['initTime']['std']:.4f}\n"
-            f"WaitTime,{stats['waitTime']['avg']:.4f},{stats['waitTime']['min']:.4f},{stats['waitTime']['max']:.4f},{stats['waitTime']['std']:.4f}\n"
-            f"Duration,{stats['duration']['avg']:.4f},{stats['duration']['min']:.4f},{stats['duration']['max']:.4f},{stats['duration']['std']:.4f}\n"
-            f"Client Elapsed Time,{stats['client_elapsed_time']['avg']:.4f},{stats['client_elapsed_time']['min']:.4f},{stats['client_elapsed_time']['max']:.4f},{stats['client_elapsed_time']['std']:.4f}\n"
-            f"Success Rate,{stats['success_rate']:.2f}%,-,-,-\n"
-        )
-
+        result = "".join(",".join(row) + "\n" for row in [RESULTS_HEADERS, *rows])
 
     else:
-        headers = ["Metric", "Average", "Minimum", "Maximum", "Standard Deviation"]
-        table_data = [
-            ["InitTime", f"{stats['initTime']['avg']:.4f}", f"{stats['initTime']['min']:.4f}", f"{stats['initTime']['max']:.4f}", f"{stats['initTime']['std']:.4f}"],
-            ["WaitTime", f"{stats['waitTime']['avg']:.4f}", f"{stats['waitTime']['min']:.4f}", f"{stats['waitTime']['max']:.4f}", f"{stats['waitTime']['std']:.4f}"],
-            ["Duration", f"{stats['duration']['avg']:.4f}", f"{stats['duration']['min']:.4f}", f"{stats['duration']['max']:.4f}", f"{stats['duration']['std']:.4f}"],
-            ["Client Elapsed Time", f"{stats['client_elapsed_time']['avg']:.4f}", f"{stats['client_elapsed_time']['min']:.4f}", f"{stats['client_elapsed_time']['max']:.4f}", f"{stats['client_elapsed_time']['std']:.4f}"],
-            ["Success Rate", f"{stats['success_rate']:.2f}%", "-", "-", "-"]
-        ]
-
-        # Truncate the payload if it exceeds the maximum length
-        payload_str = json.dumps(config.payload, indent=4)
+        # Encode the payload once: its length is the reported size, and it is shown truncated if it exceeds the maximum length
+        payload_json = json.dumps(config.payload)
+        payload_str = payload_json
         if len(payload_str) > 500:
             payload_str = payload_str[:500] + '... (truncated)'
 
@@ -100,34 +146,50 @@ def format_results(stats, config):
             f"Number of Warp-up invocations: {config.warmup_invocations}\n"
             f"Number of runs: {config.num_runs}\n"
             f"Number of invocations per run: {config.num_invocations}\n\n"
-            f"Payload size: {len(json.dumps(config.payload))} bytes\n"
+            f"Payload size: {len(payload_json)} bytes\n"
             f"Payload: {payload_str}\n\n"
-            f"{tabulate(table_data, headers=headers, tablefmt='grid')}\n"
+            f"{tabulate(rows, headers=RESULTS_HEADERS, tablefmt='grid')}\n"
         )
 
     return result
 
 
+def format_csv_rows(stats):
+    """
+    Formats the statistics as CSV rows (dicts keyed by CSV_FIELDNAMES).
+    """
+    # One row per metric, the success rate only fills the average column
+    *metric_rows, success_row = format_metric_rows(stats)
+    rows = [dict(zip(CSV_FIELDNAMES, row)) for row in metric_rows]
+    rows.append({'Metric': success_row[0], 'Average': success_row[1]})
+    return rows
+
+
 def write_results_to_file_csv(stats, config):
     """
     Writes the benchmark results to a specified CSV file.
     """
     with open(config.output_file, 'w', newline='') as csvfile:
-        fieldnames = ['Metric', 'Average', 'Min', 'Max', 'Std', 'Success Rate']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDNAMES)
 
         # Write headers
         writer.writeheader()
+        writer.writerows(format_csv_rows(stats))
+
+    log.info(f"Results written to {config.output_file}")
+
+
+def write_batch_results_to_file_csv(batch_stats, config):
+    """
+    Writes the results of every job of a batch to a single CSV file.
+    batch_stats is a list of (function, stats) tuples, in the order of the jobs.
+    """
+    with open(config.output_file, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['Job', 'Function'] + CSV_FIELDNAMES)
 
-        # Write rows for each metric
-        writer.writerow({'Metric': 'InitTime', 'Average': f"{stats['initTime']['avg']:.4f}",
-                         'Min': f"{stats['initTime']['min']:.4f}", 'Max': f"{stats['initTime']['max']:.4f}", 'Std': f"{stats['initTime']['std']:.4f}"})
-        writer.writerow({'Metric': 'WaitTime', 'Average': f"{stats['waitTime']['avg']:.4f}",
-                         'Min': f"{stats['waitTime']['min']:.4f}", 'Max': f"{stats['waitTime']['max']:.4f}", 'Std': f"{stats['waitTime']['std']:.4f}"})
-        writer.writerow({'Metric': 'Duration', 'Average': f"{stats['duration']['avg']:.4f}",
-                         'Min': f"{stats['duration']['min']:.4f}", 'Max': f"{stats['duration']['max']:.4f}", 'Std': f"{stats['duration']['std']:.4f}"})
-        writer.writerow({'Metric': 'Client Elapsed Time', 'Average': f"{stats['client_elapsed_time']['avg']:.4f}",
-                         'Min': f"{stats['client_elapsed_time']['min']:.4f}", 'Max': f"{stats['client_elapsed_time']['max']:.4f}", 'Std': f"{stats['client_elapsed_time']['std']:.4f}"})
-        writer.writerow({'Metric': 'Success Rate', 'Average': f"{stats['success_rate']:.2f}%", 'Min': '', 'Max': ''})
+        # Write headers
+        writer.writeheader()
+        for job, (function, stats) in enumerate(batch_stats, start=1):
+            writer.writerows({'Job': job, 'Function': function, **row} for row in format_csv_rows(stats))
 
     log.info(f"Results written to {config.output_file}")
@@ -1,37 +1,93 @@
 import time
+import asyncio
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import logging as log
-import json
-import pprint
-from .metrics import extract_metrics, benchmark_statistics, format_results, write_results_to_file_csv
+import orjson
+from .config import load_json_file
+from .metrics import RunningStats, allocate_metrics, extract_metrics, format_results, write_results_to_file_csv, write_batch_results_to_file_csv
 import os
 
+# Fields a batch job can override, the rest of the configuration is shared by all the jobs
+BATCH_JOB_FIELDS = ('function', 'payload', 'num_invocations')
+
+# Polling of non-blocking activations: the first delay is config.time_precision,
+# and grows by the backoff factor up to POLL_MAX_DELAY (s) for long activations
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_DELAY = 0.05
+
+
 def format_response_dict(response):
     """
-    Format the __dict__ of a response, including decoding and formatting the '_content' field if it's JSON.
+    Format the status code, headers and content of a response, pretty-printing the content if it's JSON.
     """
-    response_dict = response.__dict__.copy()
+    headers = "\n".join(f"  {key}: {value}" for key, value in response.headers.items())
+
+    # Try to pretty-print the content if it contains JSON data
+    try:
+        content = orjson.dumps(orjson.loads(response.content), option=orjson.OPT_INDENT_2).decode('utf-8')
+    except orjson.JSONDecodeError:
+        # If the content is not valid JSON, show it as-is
+        content = response.content.decode('utf-8', errors='replace')
+
+    return f"Status code: {response.status_code}\nHeaders:\n{headers}\nContent:\n{content}"
+
 
-    # Try to decode and pretty-print the '_content' field if it contains JSON data
-    if isinstance(response_dict.get('_content'), bytes):
-        try:
-            decoded_content = response_dict['_content'].decode('utf-8')  # Decode bytes to string
-            json_content = json.loads(decoded_content)  # Parse string as JSON
-            response_dict['_content'] = json_content  # Store as a dict instead of a string
-        except (UnicodeDecodeError, json.JSONDecodeError):
-            # If _content is not valid JSON, leave it as-is
-            pass
+def log_responses(response=None, post_response=None, get_response=None):
+    """
+    Logs the responses of an invocation. The responses are only formatted if the INFO level is enabled (verbose).
+    """
+    if not log.getLogger().isEnabledFor(log.INFO):
+        return
 
-    return pprint.pformat(response_dict)
+    if response is not None:
+        log.info(f"\n\nResponse:\n{format_response_dict(response)}\n")
+    if post_response is not None:
+        log.info(f"\n\nPost response:\n{format_response_dict(post_response)}\n")
+    if get_response is not None:
+        log.info(f"\nGet response:\n{format_response_dict(get_response)}\n")
+
+
+def create_session(config):
+    """
+    Creates the HTTP session shared by all the invocations, so the TCP (and TLS) connection is reused between calls.
+    In aio mode this is an AioSession, otherwise a requests.Session.
+    """
+    # Semaphore(0) would never release in aio mode (and TCPConnector(limit=0) means unlimited)
+    if config.concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {config.concurrency}")
+
+    if config.aio:
+        return AioSession(config)
+
+    session = requests.Session()
+    session.headers.update(config.headers)
+
+    # Keep one pooled connection per concurrent invocation
+    adapter = HTTPAdapter(pool_maxsize=config.concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def close_session(config):
+    """
+    Closes the HTTP session of the configuration, if any. A new one is created by the next benchmark.
+    """
+    if config.session is not None:
+        config.session.close()
+        config.session = None
 
 
 def sync_call(config):
     """
     Executes a synchronous call to the specified function.
     """
-    url = config.apihost+'/namespaces/_/actions/'+config.function+'?blocking=true&result=true&workers='+str(config.workers)
-    response = requests.post(url, json=config.payload, headers={'Authorization': config.authorization})
-    response.client_elapsed_time = response.elapsed.total_seconds() * 1000
+    start_time = time.perf_counter_ns()
+    response = config.session.post(config.sync_url, data=config.payload_bytes)
+    response.client_elapsed_time = (time.perf_counter_ns() - start_time) / 1e6
     return response
 
 
@@ -40,21 +96,104 @@ def async_call(config):
     Executes an asynchronous call to the specified function.
     It first posts the request to the function endpoint and then polls the activation to get the result.
     """
-    url = config.apihost+'/namespaces/_/actions/'+config.function+'?blocking=false&result=true&workers='+str(config.workers)
-
-    start_time = time.time()
-    post_response = requests.post(url, json=config.payload, headers={'Authorization': config.authorization})
-    activation_id = post_response.json()["activationId"]
-    url = config.apihost+'/namespaces/_/activations/'+activation_id
+    start_time = time.perf_counter_ns()
+    post_response = config.session.post(config.async_url, data=config.payload_bytes)
+    activation_id = orjson.loads(post_response.content)["activationId"]
+    url = config.activation_url_prefix + activation_id
 
-    # Wait until the worker completes the job
+    # Wait until the worker completes the job, backing off exponentially from the time precision
+    delay = config.time_precision/1000
+    max_delay = max(delay, POLL_MAX_DELAY)
     while True:
-        get_response = requests.get(url, headers={'Authorization': config.authorization})
+        get_response = config.session.get(url)
         if get_response.status_code == 200: # Activation completed
             break
-        time.sleep(config.time_precision/1000)
+        time.sleep(delay)
+        delay = min(max_delay, delay * POLL_BACKOFF_FACTOR)
         
-    get_response.client_elapsed_time = (time.time() - start_time) * 1000
+    get_response.client_elapsed_time = (time.perf_counter_ns() - start_time) / 1e6
+
+    return post_response, get_response
+
+
+class AioSession:
+    """
+    aiohttp ClientSession together with the event loop it is bound to.
+    Both are kept open across all the batches of invocations (warm-up, runs, directory files and batch jobs),
+    so the connections opened during the warm-up are reused by the measured runs.
+    """
+    def __init__(self, config):
+        self.loop = asyncio.new_event_loop()
+        self.client = self.run(self.create_client(config))
+
+    @staticmethod
+    async def create_client(config):
+        connector = aiohttp.TCPConnector(limit=config.concurrency)
+        return aiohttp.ClientSession(connector=connector, headers=config.headers)
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine to completion on the session's event loop.
+        """
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        self.run(self.client.close())
+        self.loop.close()
+
+
+class AioResponse:
+    """
+    Requests-like view of an aiohttp response, with its body already read.
+    """
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+async def read_aio_response(response):
+    """
+    Reads an aiohttp response into an AioResponse so it can be used once the connection is released.
+    """
+    return AioResponse(response.status, dict(response.headers), await response.read())
+
+
+async def sync_call_aio(config, session):
+    """
+    Executes a synchronous call to the specified function using aiohttp.
+    """
+    start_time = time.perf_counter_ns()
+    async with session.post(config.sync_url, data=config.payload_bytes) as response:
+        response = await read_aio_response(response)
+    response.client_elapsed_time = (time.perf_counter_ns() - start_time) / 1e6
+
+    return response
+
+
+async def async_call_aio(config, session):
+    """
+    Executes an asynchronous call to the specified function using aiohttp.
+    It first posts the request to the function endpoint and then polls the activation to get the result.
+    """
+    start_time = time.perf_counter_ns()
+    async with session.post(config.async_url, data=config.payload_bytes) as response:
+        post_response = await read_aio_response(response)
+    activation_id = orjson.loads(post_response.content)["activationId"]
+    url = config.activation_url_prefix + activation_id
+
+    # Wait until the worker completes the job, backing off exponentially from the time precision
+    delay = config.time_precision/1000
+    max_delay = max(delay, POLL_MAX_DELAY)
+    while True:
+        async with session.get(url) as response:
+            get_response = await read_aio_response(response)
+        if get_response.status_code == 200: # Activation completed
+            break
+        await asyncio.sleep(delay)
+        delay = min(max_delay, delay * POLL_BACKOFF_FACTOR)
+
+    get_response.client_elapsed_time = (time.perf_counter_ns() - start_time) / 1e6
 
     return post_response, get_response
 
@@ -67,74 +206,114 @@ def bench_single_invocations(config):
     if config.blocking:
         response = sync_call(config)
         #log.info(f"\n\nResponse: {response.__dict__}")
-        log.info(f"\n\nResponse:\n{format_response_dict(response)}\n")
+        log_responses(response=response)
         return extract_metrics(response, config)
     else:
         post_response, get_response = async_call(config)
-        log.info(f"\n\nPost response:\n{format_response_dict(post_response)}\n")
-        log.info(f"\nGet response:\n{format_response_dict(get_response)}\n")
+        log_responses(post_response=post_response, get_response=get_response)
         return extract_metrics(get_response, config)
 
 
-def bench_multiple_invocations(config, warmup=False):
+async def bench_single_invocations_aio(config, session, semaphore):
+    """
+    Executes a single invocation on the event loop, waiting for a free slot in the semaphore.
+    It handles both blocking and non-blocking calls.
+    """
+    async with semaphore:
+        if config.blocking:
+            response = await sync_call_aio(config, session)
+            log_responses(response=response)
+            return extract_metrics(response, config)
+        else:
+            post_response, get_response = await async_call_aio(config, session)
+            log_responses(post_response=post_response, get_response=get_response)
+            return extract_metrics(get_response, config)
+
+
+async def bench_multiple_invocations_aio(config, num_invocations):
+    """
+    Executes the invocations concurrently on the event loop of the configuration's AioSession.
+    Up to config.concurrency invocations are in flight at the same time.
+    """
+    semaphore = asyncio.Semaphore(config.concurrency)
+    session = config.session.client
+    return await asyncio.gather(*[bench_single_invocations_aio(config, session, semaphore) for _ in range(num_invocations)])
+
+
+def bench_multiple_invocations(config, metrics, success):
     """
-    Executes the specified number of invocations for a single invocation run.
-    Collects the metrics for each invocation.
+    Executes one invocation per row of the metrics arrays (see allocate_metrics).
+    Up to config.concurrency invocations are in flight at the same time.
+    Stores the metrics of the i-th invocation in metrics[i] and success[i].
     """
-    if warmup:
-        for _ in range(config.warmup_invocations):
-            bench_single_invocations(config)
+    num_invocations = len(metrics)
+
+    if config.aio:
+        results = config.session.run(bench_multiple_invocations_aio(config, num_invocations))
     else:
-        metrics_list = []
-        for _ in range(config.num_invocations):
-            metrics = bench_single_invocations(config)
-            metrics_list.append(metrics)
-        return metrics_list
+        with ThreadPoolExecutor(max_workers=config.concurrency) as executor:
+            results = list(executor.map(lambda _: bench_single_invocations(config), range(num_invocations)))
 
+    for i, (*timings, succeeded) in enumerate(results):
+        metrics[i] = timings
+        success[i] = succeeded
 
 
-def run_directory_benchmark(config):
+def run_directory_benchmark(config, running_stats):
     """
     Executes the benchmark iterating over each json file in the specified directory as input.
+    The metrics of each file are merged into running_stats.
     """
-    all_metrics = []
+    metrics, success = allocate_metrics(config.num_invocations)
 
     # Iterate over each file in the directory
     for file in os.listdir(config.directory):
         if file.endswith(".json"):
-            with open(config.directory + '/' + file) as f:
-                config.payload = json.load(f)
-                log.info(f"\n\nRunning benchmark for file: {file}")
-                metrics_list = bench_multiple_invocations(config)
-                all_metrics.extend(metrics_list)
-                
-    return all_metrics
+            config.payload = load_json_file(config.directory + '/' + file)
+            config.build_requests()
+            log.info(f"\n\nRunning benchmark for file: {file}")
+            bench_multiple_invocations(config, metrics, success)
+            running_stats.update(metrics, success)
 
 
 
 
 
-def run_benchmark(config):
+def benchmark(config):
     """
-    Executes the benchmark process based on the configuration.
-    Handles multiple runs and gathers statistics for each run.
+    Executes the warm-up and the benchmark runs based on the configuration.
+    Returns the statistics of all the invocations.
     """
-    all_metrics = []
+    running_stats = RunningStats()
+
+    config.build_requests()
+    if config.session is None:
+        config.session = create_session(config)
 
     # Warm-up runs (ignored in results)
     log.info(f"\nStarting Warm-up")
-    bench_multiple_invocations(config, warmup=True)
+    bench_multiple_invocations(config, *allocate_metrics(config.warmup_invocations))
 
     if config.directory:
-        all_metrics.extend(run_directory_benchmark(config))
+        run_directory_benchmark(config, running_stats)
     else:
+        # The same arrays are reused for every run, only the running statistics are kept
+        metrics, success = allocate_metrics(config.num_invocations)
         for run in range(config.num_runs):
             log.info(f"\nStarting run {run + 1}/{config.num_runs}")
-            metrics_list = bench_multiple_invocations(config)
-            all_metrics.extend(metrics_list)
+            bench_multiple_invocations(config, metrics, success)
+            running_stats.update(metrics, success)
 
     # Calculate statistics
-    stats = benchmark_statistics(all_metrics)
+    return running_stats.statistics()
+
+
+def run_benchmark(config):
+    """
+    Executes the benchmark process based on the configuration.
+    Handles multiple runs and gathers statistics for each run.
+    """
+    stats = benchmark(config)
 
     # Format and display results
     results = format_results(stats, config)
@@ -143,4 +322,53 @@ def run_benchmark(config):
     # Write to file if output file is specified
     if config.output_file:
         write_results_to_file_csv(stats, config)
-        
\ No newline at end of file
+
+
+def run_batch(config, batch_file):
+    """
+    Executes one benchmark per line of a JSONL file within the same process.
+    Each line is a json object that can override the function, payload and num_invocations of the configuration.
+    The HTTP session is reused by all the jobs, and the results of every job are written to a single CSV file.
+    """
+    base = {field: getattr(config, field) for field in BATCH_JOB_FIELDS}
+    batch_stats = []
+
+    # Validate every job before running any of them
+    jobs = []
+    with open(batch_file, 'rb') as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                job = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                raise ValueError(f"{batch_file}:{line_number}: invalid json ({e})") from e
+            if not isinstance(job, dict):
+                raise ValueError(f"{batch_file}:{line_number}: each batch job must be a json object")
+            unknown = set(job) - set(BATCH_JOB_FIELDS)
+            if unknown:
+                raise ValueError(f"{batch_file}:{line_number}: unknown job fields {sorted(unknown)} (allowed: {list(BATCH_JOB_FIELDS)})")
+            if 'function' in job and not isinstance(job['function'], str):
+                raise ValueError(f"{batch_file}:{line_number}: function must be a string")
+            if 'num_invocations' in job and (type(job['num_invocations']) is not int or job['num_invocations'] < 1):
+                raise ValueError(f"{batch_file}:{line_number}: num_invocations must be a positive integer")
+            jobs.append(job)
+
+    try:
+        for job_number, job in enumerate(jobs, start=1):
+            for field in BATCH_JOB_FIELDS:
+                setattr(config, field, job.get(field, base[field]))
+
+            log.info(f"\n\nRunning batch job {job_number}/{len(jobs)}: {config.function}")
+            stats = benchmark(config)
+            print(format_results(stats, config))
+            batch_stats.append((config.function, stats))
+    finally:
+        # Restore the shared configuration, even if a job failed
+        for field in BATCH_JOB_FIELDS:
+            setattr(config, field, base[field])
+        config.build_requests()
+
+    # Write to file if output file is specified
+    if config.output_file:
+        write_batch_results_to_file_csv(batch_stats, config)
@@ -1,10 +1,16 @@
-from openwhisk_bench import Config, run_benchmark
+from openwhisk_bench import Config, run_benchmark, run_batch, close_session
 
 def main():
     config = Config()
     config.parse_arguments()
     config.print_config()
-    run_benchmark(config)
+    try:
+        if config.batch:
+            run_batch(config, config.batch)
+        else:
+            run_benchmark(config)
+    finally:
+        close_session(config)
 
 
 if __name__ == '__main__':